@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Optional
 
 import numpy as np
@@ -20,6 +21,96 @@ from .render import render
 log = get_pylogger(__name__)
 
 
+def _decap_core(z1, decap, freq, probes, pIndx):
+    """Decap simulation core: scores of the probing ports after placing decaps at `pIndx`.
+    Since we only need the impedance at the probes, we solve the Schur complement for the
+    probe entries instead of computing the whole impedance matrix after placement as in
+    `_decap_placement`, which also avoids the explicit matrix inverse
+
+    Args:
+        z1: PDN impedance matrix [num_freq, size**2, size**2]
+        decap: decap impedance [num_freq]
+        freq: frequencies [num_freq]
+        probes: indices of the probing ports [batch_size, num_probes]
+        pIndx: indices of the placed decaps [batch_size, num_decaps]
+
+    Returns:
+        scores: decap score for each probing port [batch_size, num_probes]
+    """
+    # Sub-matrices for each instance of the batch [num_freq, batch_size, rows, cols]
+    z1ap = z1[:, probes[..., :, None], pIndx[..., None, :]]
+    z1pa = z1[:, pIndx[..., :, None], probes[..., None, :]]
+    z1pp = z1[:, pIndx[..., :, None], pIndx[..., None, :]]
+    z1aa = z1[:, probes, probes]  # [num_freq, batch_size, num_probes]
+
+    # Add the decap impedance z2qq on the diagonal, i.e. z1pp + z2qq
+    broadcast = (-1,) + (1,) * pIndx.dim()
+    z1pp.diagonal(dim1=-2, dim2=-1).add_(torch.abs(decap).view(broadcast))
+
+    # zout[a, a] = z1aa[a, a] - z1ap[a] @ (z1pp + z2qq)^-1 @ z1pa[:, a] for each probe a
+    x = torch.linalg.solve(z1pp, z1pa)
+    zout = z1aa - torch.sum(z1ap * x.transpose(-1, -2), dim=-1)
+
+    z_initial = torch.abs(z1aa)
+    z_final = torch.abs(zout)
+
+    # Same as `_decap_model`, reduced over the frequencies for each probe
+    impedance_gap = z_initial - z_final
+    return torch.sum(impedance_gap * 1000000000 / freq.view(broadcast), dim=0) / 10
+
+
+def _masked_min(scores, mask):
+    """Min of the scores over the last dimension, ignoring padded entries"""
+    return scores.masked_fill(~mask, float("inf")).min(dim=-1).values
+
+
+def _masked_mean(scores, mask):
+    """Mean of the scores over the last dimension, ignoring padded entries"""
+    return (scores * mask).sum(dim=-1) / mask.sum(dim=-1)
+
+
+@lru_cache(32)
+def _specs_for(size: int, min_loc: float, max_loc: float) -> dict:
+    """Specs of the MDPP environment for a given grid. These are shared across envs,
+    so they should be cloned before use
+    """
+    return dict(
+        observation_spec=CompositeSpec(
+            locs=BoundedTensorSpec(
+                low=min_loc,
+                high=max_loc,
+                shape=(size**2, 2),
+                dtype=torch.float32,
+            ),
+            probe=UnboundedDiscreteTensorSpec(
+                shape=(1),
+                dtype=torch.int64,
+            ),
+            keepout=UnboundedDiscreteTensorSpec(
+                shape=(size**2),
+                dtype=torch.bool,
+            ),
+            i=UnboundedDiscreteTensorSpec(
+                shape=(1),
+                dtype=torch.int64,
+            ),
+            action_mask=UnboundedDiscreteTensorSpec(
+                shape=(size**2),
+                dtype=torch.bool,
+            ),
+            shape=(),
+        ),
+        action_spec=BoundedTensorSpec(
+            shape=(1,),
+            dtype=torch.int64,
+            low=0,
+            high=size**2,
+        ),
+        reward_spec=UnboundedContinuousTensorSpec(shape=(1,)),
+        done_spec=UnboundedDiscreteTensorSpec(shape=(1,), dtype=torch.bool),
+    )
+
+
 class MDPPEnv(DPPEnv):
     """Multiple decap placement problem (mDPP) environment
     This is a modified version of the DPP environment where we allow multiple probing ports
@@ -70,6 +161,13 @@ class MDPPEnv(DPPEnv):
             "meansum",
         ], "reward_type must be minmax or meansum"
         self.reward_type = reward_type
+        # Resolve the reduction of the probe scores once instead of at every reward call
+        self._reduce_scores = _masked_min if reward_type == "minmax" else _masked_mean
+
+        # Run the decap simulation in single precision: this halves the memory traffic
+        # over the PDN impedance matrix and keeps the ordering of the decap scores
+        self.raw_pdn = self.raw_pdn.to(torch.complex64)
+        self.freq = self.freq.to(torch.float32)
 
         self._make_spec(self.generator)
 
@@ -82,50 +180,20 @@ class MDPPEnv(DPPEnv):
         td_reset = super()._reset(td, batch_size=batch_size)
 
         # Action mask is 0 if both action_mask (e.g. keepout) and probe are 0
-        action_mask = torch.logical_and(td_reset["action_mask"], ~td_reset["probe"])
-        # Keepout regions are the inverse of action_mask
-        td_reset.update(
-            {
-                "keepout": ~td_reset["action_mask"],
-                "action_mask": action_mask,
-            }
-        )
+        # Note that `super()._reset` passes the input action_mask through and already sets
+        # the keepout regions as its inverse, so we only update a fresh buffer in place
+        action_mask = ~td_reset["probe"]
+        action_mask &= td_reset["action_mask"]
+        td_reset.set("action_mask", action_mask)
         return td_reset
 
     def _make_spec(self, generator: MDPPGenerator):
-        self.observation_spec = CompositeSpec(
-            locs=BoundedTensorSpec(
-                low=generator.min_loc,
-                high=generator.max_loc,
-                shape=(generator.size**2, 2),
-                dtype=torch.float32,
-            ),
-            probe=UnboundedDiscreteTensorSpec(
-                shape=(1),
-                dtype=torch.int64,
-            ),
-            keepout=UnboundedDiscreteTensorSpec(
-                shape=(generator.size**2),
-                dtype=torch.bool,
-            ),
-            i=UnboundedDiscreteTensorSpec(
-                shape=(1),
-                dtype=torch.int64,
-            ),
-            action_mask=UnboundedDiscreteTensorSpec(
-                shape=(generator.size**2),
-                dtype=torch.bool,
-            ),
-            shape=(),
-        )
-        self.action_spec = BoundedTensorSpec(
-            shape=(1,),
-            dtype=torch.int64,
-            low=0,
-            high=generator.size**2,
-        )
-        self.reward_spec = UnboundedContinuousTensorSpec(shape=(1,))
-        self.done_spec = UnboundedDiscreteTensorSpec(shape=(1,), dtype=torch.bool)
+        # Specs only depend on the grid, so we build them once and clone them per env
+        specs = _specs_for(generator.size, generator.min_loc, generator.max_loc)
+        self.observation_spec = specs["observation_spec"].clone()
+        self.action_spec = specs["action_spec"].clone()
+        self.reward_spec = specs["reward_spec"].clone()
+        self.done_spec = specs["done_spec"].clone()
 
     def _get_reward(self, td, actions):
         """We call the reward function with the final sequence of actions to get the reward
@@ -136,26 +204,49 @@ class MDPPEnv(DPPEnv):
             td = td.unsqueeze(0)
             actions = actions.unsqueeze(0)
 
-        # Reward calculation is expensive since we need to run decap simulation (not vectorizable)
-        reward = torch.stack(
-            [
-                self._single_env_reward(td_single, action)
-                for td_single, action in zip(td, actions)
-            ]
-        )
-        return reward
+        # Pad the probes of all envs to the max number of probes, masking the padding.
+        # The topk of the probe mask puts the probes first, so unlike `nonzero` we get
+        # fixed size indices without a device sync; padded entries point to non-probe
+        # locations (possibly decaps) and are masked out of the reduction
+        probe = td["probe"]
+        max_probes = int(probe.sum(-1).max())
+        mask, probes = probe.to(torch.uint8).topk(max_probes, dim=-1)
+        mask = mask.bool()
+
+        # Reward calculation is expensive since we need to run decap simulation,
+        # so we simulate all envs and probes in a single batch
+        scores = self._decap_simulator_batch(probes, actions)
+        # If minmax, return min of max decap scores else mean
+        return self._reduce_scores(scores, mask)
 
     @staticmethod
     def check_solution_validity(td: TensorDict, actions: torch.Tensor):
         assert True, "Not implemented"
 
-    def _single_env_reward(self, td, actions):
-        """Get reward for single environment. We"""
+    def _decap_simulator_batch(self, probes, solution):
+        """Batched version of `_decap_simulator` over environments and probing ports.
+        The impedance after decap placement only depends on the solution, so we
+        simulate it once for all the probes of each environment
 
-        list_probe = torch.nonzero(td["probe"]).squeeze()
-        scores = torch.zeros_like(list_probe, dtype=torch.float32)
-        for i, probe in enumerate(list_probe):
-            # Get the decap scores for the probe location
-            scores[i] = self._decap_simulator(probe, actions)
-        # If minmax, return min of max decap scores else mean
-        return scores.min() if self.reward_type == "minmax" else scores.mean()
+        Args:
+            probes: indices of the probing ports [batch_size, num_probes]
+            solution: indices of the placed decaps [batch_size, num_decaps]
+
+        Returns:
+            scores: decap score for each probing port [batch_size, num_probes]
+        """
+        device = solution.device
+
+        sorted_solution = torch.sort(solution, dim=-1).values
+        assert (
+            sorted_solution[..., 1:] != sorted_solution[..., :-1]
+        ).all(), "An Element of Decap Sequence must be Unique"
+
+        scores = _decap_core(
+            self.raw_pdn.to(device),
+            self.decap.reshape(-1).to(device),
+            self.freq.to(device),
+            probes.long(),
+            solution.long(),
+        )
+        return scores.to(torch.float32)
@@ -15,6 +15,31 @@ from rl4co.envs.common.utils import get_sampler, Generator
 
 log = get_pylogger(__name__)
 
+# Location labels used during generation
+_AVAILABLE, _KEEPOUT, _PROBE = 0, 1, 2
+
+
+def _sample_locations(num, num_max, num_loc):
+    """Sample distinct locations for all the samples at once as the `topk` of random
+    scores. Since the number of locations differs per sample, we sample `num_max` of
+    them and only keep the first `num` ones of each sample
+
+    Args:
+        num: number of locations to sample for each sample [batch_size, 1]. Sampling
+            happens on the same device
+        num_max: maximum number of locations to sample
+        num_loc: number of locations of each sample
+
+    Returns:
+        idx: sampled location indices [batch_size, num_max]
+        keep: whether each sampled location is kept [batch_size, num_max]
+    """
+    num_max = min(num_max, num_loc)
+    scores = torch.rand((*num.shape[:-1], num_loc), device=num.device)
+    idx = scores.topk(num_max, dim=-1).indices
+    keep = torch.arange(num_max, device=num.device) < num
+    return idx, keep
+
 
 class MDPPGenerator(Generator):
     """Data generator for the Multi Decap Placement Problem (MDPP).
@@ -31,6 +56,7 @@ class MDPPGenerator(Generator):
         decap_file: Name of the decap file. Defaults to "01nF_decap.npy".
         freq_file: Name of the frequency file. Defaults to "freq_201.npy".
         url: URL to download data from. Defaults to None.
+        device: Device on which the data is sampled and returned. Defaults to "cpu".
     
     Returns:
         A TensorDict with the following keys:
@@ -53,6 +79,7 @@ class MDPPGenerator(Generator):
         decap_file: str = "01nF_decap.npy",
         freq_file: str = "freq_201.npy",
         url: str = None,
+        device: str = "cpu",
         **unused_kwargs
     ):
         self.min_loc = min_loc
@@ -63,6 +90,7 @@ class MDPPGenerator(Generator):
         self.num_probes_max = num_probes_max
         self.max_decaps = max_decaps
         self.data_dir = data_dir
+        self.device = torch.device(device)
 
         # DPP environment doen't have any other kwargs
         if len(unused_kwargs) > 0:
@@ -80,6 +108,14 @@ class MDPPGenerator(Generator):
         )
         self._load_dpp_data(chip_file, decap_file, freq_file)
 
+        # Locations on the grid normalized by the number of rows and columns. They are
+        # the same for every instance, so we build them once and expand them per batch
+        m = n = self.size
+        locs = torch.meshgrid(torch.arange(m), torch.arange(n), indexing="ij")
+        locs = torch.stack(locs, dim=-1).reshape(-1, 2)
+        locs = locs / torch.tensor([m, n], dtype=torch.float)
+        self._locs_template = locs.to(self.device)
+
         # Check the validity of the keepout parameters
         assert (
             num_keepout_min <= num_keepout_max
@@ -95,41 +131,42 @@ class MDPPGenerator(Generator):
         batched = len(batch_size) > 0
         bs = [1] if not batched else batch_size
 
-        # Create a list of locs on a grid
-        locs = torch.meshgrid(torch.arange(m), torch.arange(n))
-        locs = torch.stack(locs, dim=-1).reshape(-1, 2)
-        # normalize the locations by the number of rows and columns
-        locs = locs / torch.tensor([m, n], dtype=torch.float)
-        locs = locs[None].expand(*bs, -1, -1)
+        # Grid locations are shared by all instances of the batch. We copy the cached
+        # template so that writes into the output cannot reach later calls
+        locs = self._locs_template.clone().expand(*bs, -1, -1)
 
-        # Create available mask
-        available = torch.ones((*bs, m * n), dtype=torch.bool)
+        # Label each location in a single buffer; higher labels take precedence,
+        # so that probes sampled over keepout regions are still probes
+        labels = torch.full(
+            (*bs, m * n), _AVAILABLE, dtype=torch.int8, device=self.device
+        )
 
         # Sample probe location from m*n
-        probe = torch.randint(m * n, size=(*bs, 1))
-        available.scatter_(1, probe, False)
+        probe = torch.randint(m * n, size=(*bs, 1), device=self.device)
+        labels.scatter_(1, probe, _KEEPOUT)
 
         # Sample probe locatins
         num_probe = torch.randint(
             self.num_probes_min,
             self.num_probes_max,
             size=(*bs, 1),
+            device=self.device,
         )
-        probe = [torch.randperm(m * n)[:p] for p in num_probe]
-        probes = torch.zeros((*bs, m * n), dtype=torch.bool)
-        for i, (a, p) in enumerate(zip(available, probe)):
-            available[i] = a.scatter(0, p, False)
-            probes[i] = probes[i].scatter(0, p, True)
+        idx, keep = _sample_locations(num_probe, self.num_probes_max, m * n)
+        labels.scatter_reduce_(1, idx, keep.to(torch.int8).mul_(_PROBE), reduce="amax")
 
         # Sample keepout locations from m*n except probe
         num_keepout = torch.randint(
             self.num_keepout_min,
             self.num_keepout_max,
             size=(*bs, 1),
+            device=self.device,
         )
-        keepouts = [torch.randperm(m * n)[:k] for k in num_keepout]
-        for i, (a, k) in enumerate(zip(available, keepouts)):
-            available[i] = a.scatter(0, k, False)
+        idx, keep = _sample_locations(num_keepout, self.num_keepout_max, m * n)
+        labels.scatter_reduce_(1, idx, keep.to(torch.int8).mul_(_KEEPOUT), reduce="amax")
+
+        probes = labels.eq(_PROBE)
+        available = labels.eq(_AVAILABLE)
 
         return TensorDict(
             {
@@ -138,6 +175,7 @@ class MDPPGenerator(Generator):
                 "action_mask": available if batched else available.squeeze(0),
             },
             batch_size=batch_size,
+            device=self.device,
         )
 
     def _load_dpp_data(self, chip_file, decap_file, freq_file):
@@ -17,7 +17,8 @@ def render(self, td, actions=None, ax=None, legend=True, settings=None):
 
     import matplotlib.pyplot as plt
 
-    from matplotlib.lines import Line2D
+    from matplotlib.collections import LineCollection, PatchCollection
+    from matplotlib.colors import ListedColormap
     from matplotlib.patches import Annulus, Rectangle, RegularPolygon
 
     if settings is None:
@@ -28,10 +29,7 @@ def render(self, td, actions=None, ax=None, legend=True, settings=None):
             "decap": {"color": "tab:blue", "label": "decap"},
         }
 
-    def draw_capacitor(ax, x, y, color="black"):
-        # Backgrund rectangle: same as color but with alpha=0.5
-        ax.add_patch(Rectangle((x, y), 1, 1, color=color, alpha=0.5))
-
+    def capacitor_glyph(x, y):
         # Create the plates of the capacitor
         plate_width, plate_height = (
             0.3,
@@ -42,55 +40,30 @@ def render(self, td, actions=None, ax=None, legend=True, settings=None):
             (x + 0.5 - plate_width / 2, y + 0.5 - plate_height - plate_gap / 2),
             plate_width,
             plate_height,
-            color=color,
         )
         plate2 = Rectangle(
             (x + 0.5 - plate_width / 2, y + 0.5 + plate_gap / 2),
             plate_width,
             plate_height,
-            color=color,
         )
 
-        # Add the plates to the axes
-        ax.add_patch(plate1)
-        ax.add_patch(plate2)
-
-        # Add connection lines (wires)
+        # Create connection lines (wires)
         line_length = 0.2
-        line1 = Line2D(
-            [x + 0.5, x + 0.5],
-            [
-                y + 0.5 - plate_height - plate_gap / 2 - line_length,
-                y + 0.5 - plate_height - plate_gap / 2,
-            ],
-            color=color,
-        )
-        line2 = Line2D(
-            [x + 0.5, x + 0.5],
-            [
-                y + 0.5 + plate_height + plate_gap / 2,
-                y + 0.5 + plate_height + plate_gap / 2 + line_length,
-            ],
-            color=color,
-        )
+        line1 = [
+            (x + 0.5, y + 0.5 - plate_height - plate_gap / 2 - line_length),
+            (x + 0.5, y + 0.5 - plate_height - plate_gap / 2),
+        ]
+        line2 = [
+            (x + 0.5, y + 0.5 + plate_height + plate_gap / 2),
+            (x + 0.5, y + 0.5 + plate_height + plate_gap / 2 + line_length),
+        ]
+        return [plate1, plate2], [line1, line2]
 
-        # Add the lines to the axes
-        ax.add_line(line1)
-        ax.add_line(line2)
-
-    def draw_probe(ax, x, y, color="black"):
-        # Backgrund rectangle: same as color but with alpha=0.5
-        ax.add_patch(Rectangle((x, y), 1, 1, color=color, alpha=0.5))
-        ax.add_patch(Annulus((x + 0.5, y + 0.5), (0.2, 0.2), 0.1, color=color))
-
-    def draw_keepout(ax, x, y, color="black"):
-        # Backgrund rectangle: same as color but with alpha=0.5
-        ax.add_patch(Rectangle((x, y), 1, 1, color=color, alpha=0.5))
-        ax.add_patch(
-            RegularPolygon(
-                (x + 0.5, y + 0.5), numVertices=6, radius=0.45, color=color
-            )
-        )
+    def probe_glyph(x, y):
+        return Annulus((x + 0.5, y + 0.5), (0.2, 0.2), 0.1)
+
+    def keepout_glyph(x, y):
+        return RegularPolygon((x + 0.5, y + 0.5), numVertices=6, radius=0.45)
 
     size = self.size
     td = td.detach().cpu()
@@ -101,43 +74,64 @@ def render(self, td, actions=None, ax=None, legend=True, settings=None):
     if actions is None:
         actions = td.get("action", None)
 
-    # Transform actions from idx to one-hot
-    decaps = torch.zeros(size**2)
-    decaps.scatter_(0, actions, 1)
-    decaps = decaps.reshape(size, size)
+    # Category of each location: 0 available, 1 keepout, 2 probe, 3 decap
+    # Written in order of precedence: decaps over probes over keepouts
+    categories = np.zeros(size**2, dtype=np.int8)
+    categories[~td["action_mask"].reshape(-1).numpy()] = 1
+    categories[td["probe"].reshape(-1).numpy()] = 2
+    categories[np.asarray(actions)] = 3
 
-    keepout = ~td["action_mask"].reshape(size, size)
-    probes = td["probe"].reshape(size, size)
+    def locations(category):
+        # (x, y) coordinates of the locations of the category: rows are along y
+        y, x = np.divmod(np.flatnonzero(categories == category), size)
+        return zip(x, y)
 
     if ax is None:
         _, ax = plt.subplots(1, 1, figsize=(6, 6))
 
-    grid = np.meshgrid(np.arange(0, size), np.arange(0, size))
-    grid = np.stack(grid, axis=-1)
-
-    xdim, ydim = grid.shape[0], grid.shape[1]
-    # ax.imshow(np.zeros((xdim, ydim)), cmap="gray")
+    ax.set_xlim(0, size)
+    ax.set_ylim(0, size)
 
-    ax.set_xlim(0, xdim)
-    ax.set_ylim(0, ydim)
+    # Available locations are not drawn individually, so their color is optional
+    available = settings.get("available", {}).get("color", "white")
+    colors = [available] + [settings[k]["color"] for k in ["keepout", "probe", "decap"]]
 
-    for i in range(xdim):
-        for j in range(ydim):
-            x, y = grid[i, j, 0], grid[i, j, 1]
+    # Background of all the locations: same as color but with alpha=0.5
+    ax.pcolormesh(
+        categories.reshape(size, size),
+        cmap=ListedColormap(colors),
+        vmin=-0.5,
+        vmax=3.5,
+        alpha=0.5,
+    )
 
-            if decaps[i, j] == 1:
-                draw_capacitor(ax, x, y, color=settings["decap"]["color"])
-            elif probes[i, j] == 1:
-                draw_probe(ax, x, y, color=settings["probe"]["color"])
-            elif keepout[i, j] == 1:
-                draw_keepout(ax, x, y, color=settings["keepout"]["color"])
+    # Draw the glyphs of each category as a single collection
+    plates, wires = [], []
+    for x, y in locations(3):
+        plates_, wires_ = capacitor_glyph(x, y)
+        plates.extend(plates_)
+        wires.extend(wires_)
+    ax.add_collection(PatchCollection(plates, color=settings["decap"]["color"]))
+    ax.add_collection(LineCollection(wires, color=settings["decap"]["color"]))
+    ax.add_collection(
+        PatchCollection(
+            [probe_glyph(x, y) for x, y in locations(2)],
+            color=settings["probe"]["color"],
+        )
+    )
+    ax.add_collection(
+        PatchCollection(
+            [keepout_glyph(x, y) for x, y in locations(1)],
+            color=settings["keepout"]["color"],
+        )
+    )
 
     ax.grid(
         which="major", axis="both", linestyle="-", color="k", linewidth=1, alpha=0.5
     )
     # set 10 ticks
-    ax.set_xticks(np.arange(0, xdim, 1))
-    ax.set_yticks(np.arange(0, ydim, 1))
+    ax.set_xticks(np.arange(0, size, 1))
+    ax.set_yticks(np.arange(0, size, 1))
 
     # Invert y axis
     ax.invert_yaxis()
@@ -89,6 +89,47 @@ def test_eda(env_cls, batch_size=2, max_decaps=5):
     assert reward.shape == (batch_size,)
 
 
+@pytest.mark.parametrize("reward_type", ["minmax", "meansum"])
+def test_mdpp_reward(reward_type, batch_size=4):
+    env = MDPPEnv(reward_type=reward_type)
+    td = env.reset(batch_size=[batch_size])
+    # Mixed number of probes per instance, from 1 to batch_size
+    probe = torch.zeros_like(td["probe"])
+    for i in range(batch_size):
+        probe[i, torch.randperm(probe.shape[-1])[: i + 1]] = True
+    td["probe"] = probe
+    td["action_mask"] = td["action_mask"] & ~probe
+    scores = torch.rand(probe.shape).masked_fill(~td["action_mask"], -1)
+    actions = scores.topk(env.max_decaps, dim=-1).indices
+
+    # Reference: per-probe decap simulation of DPPEnv reduced per instance
+    reduce = torch.min if reward_type == "minmax" else torch.mean
+    expected = torch.stack(
+        [
+            reduce(torch.stack([env._decap_simulator(p, a) for p in torch.nonzero(pr)]))
+            for pr, a in zip(probe, actions)
+        ]
+    ).float()
+    reward = env.get_reward(td, actions)
+    torch.testing.assert_close(reward, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_mdpp_generator_locs_not_shared(batch_size=4):
+    generator = MDPPEnv().generator
+    locs = generator(batch_size)["locs"].clone()
+    # Writing into one instance must not change the locations of later calls
+    generator._generate([batch_size])["locs"][0].mul_(0)
+    assert torch.equal(generator(batch_size)["locs"], locs)
+
+
+def test_mdpp_single_probe(batch_size=2):
+    env = MDPPEnv(generator_params=dict(num_probes_min=1, num_probes_max=2))
+    reward, td, actions = rollout(env, env.reset(batch_size=[batch_size]), random_policy)
+    assert (td["probe"].sum(-1) == 1).all()
+    assert reward.shape == (batch_size,)
+    assert torch.isfinite(reward).all()
+
+
 @pytest.mark.parametrize("env_cls", [FFSPEnv])
 def test_scheduling(env_cls, batch_size=2):
     env = env_cls()